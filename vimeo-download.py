@@ -1,17 +1,83 @@
 #!/usr/bin/env python3
 
 import argparse
-import base64
+import bisect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from enum import Enum, auto
+import importlib.util
+import io
 import os
 import pathlib
 import re
 import requests
+from requests.adapters import HTTPAdapter
+import shutil
 import subprocess
+import threading
+import time
+from urllib.parse import urlparse
 from tqdm import tqdm
 from tty_menu import tty_menu
 
+# optional simd accelerated base64 decoding
+try:
+    from pybase64 import b64decode
+except ImportError:
+    from base64 import b64decode
+
+# optional faster master.json parsing
+try:
+    import orjson as json
+except ImportError:
+    import json
+
+# optional http/2 segment downloads, multiplexed over a single connection,
+# httpx needs h2 installed for http/2
+try:
+    import httpx
+except ImportError:
+    httpx = None
+if httpx != None and importlib.util.find_spec('h2') == None:
+    httpx = None
+
+# number of segments downloaded at the same time per stream,
+# kept low so the cdn doesn't start throttling with http 429
+MAX_WORKERS = 5
+# retries per segment when throttled
+MAX_RETRIES = 3
+# consecutive segment byte ranges are merged into requests of up to this size
+COALESCE_BYTES = 8 * 1024 * 1024
+# write buffer for stream files
+WRITE_BUFFER = 8 * 1024 * 1024
+
+# segments are copied raw to disk, so they must not be sent compressed
+_SEGMENT_HEADERS = {'Accept-Encoding': 'identity'}
+
+# segment byte range in urls of master.json?query_string_ranges=1
+_RANGE_RE = re.compile(r'[?&]range=(\d+)-(\d+)')
+# (host, master.json base_url) -> whether the top level base_url applies
+_base_url_cache = {}
+
+# '<dir>/../' path component in vimeo cdn urls
+_DOTDOT_RE = re.compile(r'/[a-zA-Z0-9_-]*/\.\./')
+
+def _normalize_url(url: str) -> str:
+    """
+    Returns: url with '<dir>/../' path components resolved
+    """
+    while True:
+        normalized = _DOTDOT_RE.sub('/', url)
+        if normalized == url:
+            return url
+        url = normalized
+
+class _RangeError(Exception):
+    """
+    The cdn didn't return the merged byte range that was requested.
+    """
+
 class AudioQuality(Enum):
     """
     Vimeo audio quality options.
@@ -42,44 +108,111 @@ class VideoQuality(Enum):
     VMAX  =    0 # select highest resolution available
 
 class VimeoDownload():
-    def __init__(self, output_file: str, master_json_url: str):
+    # shared by all downloads so keep-alive connections can be reused across
+    # segments and videos, a batch may spread over several cdn hosts
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16))
+    # segments are downloaded over http/2 when httpx and h2 are installed,
+    # the client is created on first use, see _get_segment()
+    http2_client = None
+    _http2_lock = threading.Lock()
+
+    def __init__(self, output_file: str, master_json_url: str, master_json: dict = None):
         self.output_file = output_file
         self.master_json_url = master_json_url
-        self.master_json = None
+        self.master_json = master_json
         self.base_url = None
         self.audio_json = None
         self.video_json = None
         self.audio_file = None
         self.video_file = None
 
-        # get master_json
-        response = requests.get(self.master_json_url)
-        if response.status_code == 410:
-            print(f'ERROR: http code [{response.status_code}]. master.json expired, please update url and rerun.')
-            response.raise_for_status()
-        if response.status_code != 200:
-            print(f'ERROR: received http code [{response.status_code}] when downloading master.json')
-            response.raise_for_status()
-        self.master_json = response.json()
+        # get master_json unless it was already fetched
+        if self.master_json == None:
+            self.master_json = self.fetch_master_json(self.master_json_url)
+
+        # stream properties, master_json doesn't change after loading
+        self._widths = tuple(video['width'] for video in self.master_json['video'])
+        self._heights = tuple(video['height'] for video in self.master_json['video'])
+        self._sample_rates = tuple(audio['sample_rate'] for audio in self.master_json['audio'])
+        self._bitrates = tuple(audio['bitrate'] for audio in self.master_json['audio'])
+
+        # stream index lookups, duplicate heights resolve to the widest video
+        self._bitrate_to_idx = {}
+        for index, bitrate in enumerate(self._bitrates):
+            self._bitrate_to_idx.setdefault(bitrate, index)
+        self._height_to_idx = {}
+        for index, height in enumerate(self._heights):
+            current = self._height_to_idx.get(height)
+            if current == None or self._widths[index] > self._widths[current]:
+                self._height_to_idx[height] = index
+        # unique heights low to high for the fuzzy quality search
+        self._sorted_heights = tuple(sorted(self._height_to_idx))
 
         # generate base_url
         # master.json has a top level 'base_url' that is not used everytime
         # test multiple endpoints to determine correct url path
         slash = self.master_json_url.rfind('/')
         trimmed_url = self.master_json_url[:slash + 1]
-        test_video = self.master_json['video'][0]
-        response = requests.get(
-            trimmed_url
-            + self.master_json['base_url']
-            + test_video['base_url']
-            + test_video['segments'][0]['url'],
-            stream=True
-        )
-        if response.status_code == 200:
+        # the probe result is shared by downloads from the same host and layout
+        cache_key = (urlparse(self.master_json_url).netloc, self.master_json['base_url'])
+        use_base_url = _base_url_cache.get(cache_key)
+        if use_base_url == None:
+            test_video = self.master_json['video'][0]
+            test_url = (trimmed_url
+                + self.master_json['base_url']
+                + test_video['base_url']
+                + test_video['segments'][0]['url'])
+            # only the status is needed, avoid downloading the segment
+            # responses are closed so the connection goes back to the pool clean
+            with self.session.head(test_url, allow_redirects=True) as response:
+                status_code = response.status_code
+            if not 200 <= status_code < 300:
+                # edges may reject or misroute HEAD, confirm with a single byte GET
+                with self.session.get(test_url, headers={'Range': 'bytes=0-0'}, stream=True) as response:
+                    status_code = response.status_code
+            use_base_url = 200 <= status_code < 300
+            # only cache a definite answer, transient errors are probed again
+            if use_base_url or status_code == 404:
+                _base_url_cache[cache_key] = use_base_url
+        if use_base_url:
             self.base_url = trimmed_url + self.master_json['base_url']
         else:
             self.base_url = trimmed_url
     
+    @classmethod
+    def close(cls) -> None:
+        """
+        Closes the connections shared by all downloads.
+        """
+        with cls._http2_lock:
+            if cls.http2_client != None:
+                cls.http2_client.close()
+                cls.http2_client = None
+        cls.session.close()
+
+    @classmethod
+    def from_master_json(cls, output_file: str, master_json_url: str, master_json: dict):
+        """
+        Creates a download from a master.json fetched ahead of time,
+        see fetch_master_json().
+        """
+        return cls(output_file, master_json_url, master_json)
+
+    @classmethod
+    def fetch_master_json(cls, master_json_url: str) -> dict:
+        """
+        Returns: parsed master.json
+        """
+        with cls.session.get(master_json_url) as response:
+            if response.status_code == 410:
+                print(f'ERROR: http code [{response.status_code}]. master.json expired, please update url and rerun.')
+                response.raise_for_status()
+            if response.status_code != 200:
+                print(f'ERROR: received http code [{response.status_code}] when downloading master.json')
+                response.raise_for_status()
+            return json.loads(response.content)
+
     def output_filename(self) -> str:
         return os.path.basename(self.output_file)
     
@@ -87,26 +220,24 @@ class VimeoDownload():
         return os.path.dirname(os.path.abspath(self.output_file))
     
     def list_widths(self):
-        return [video['width'] for video in self.master_json['video']]
+        return list(self._widths)
 
     def list_heights(self):
-        return [video['height'] for video in self.master_json['video']]
+        return list(self._heights)
     
     def list_sample_rates(self):
-        return [audio['sample_rate'] for audio in self.master_json['audio']]
+        return list(self._sample_rates)
     
     def list_bitrates(self):
-        return [audio['bitrate'] for audio in self.master_json['audio']]
+        return list(self._bitrates)
 
     def _ask_audio_quality(self) -> int:
         """
         Returns: audio bitrate
         """
         # organize audio rates for menu
-        samples = self.list_sample_rates()
-        samples.sort(reverse=True)
-        bitrates = self.list_bitrates()
-        bitrates.sort(reverse=True)
+        samples = sorted(self._sample_rates, reverse=True)
+        bitrates = sorted(self._bitrates, reverse=True)
 
         # create menu options
         rates = []
@@ -122,10 +253,8 @@ class VimeoDownload():
         Returns: video height
         """
         # organize display resolutions for menu
-        heights = self.list_heights()
-        heights.sort(reverse=True)
-        widths = self.list_widths()
-        widths.sort(reverse=True)
+        heights = sorted(self._heights, reverse=True)
+        widths = sorted(self._widths, reverse=True)
 
         # create menu options
         resolutions = []
@@ -176,34 +305,33 @@ class VimeoDownload():
         if audio_quality == None:
             bitrate = self._ask_audio_quality()
         else:
-            bitrates = self.list_bitrates()
-            bitrates.sort() # sorts low to high
+            bitrates = sorted(self._bitrates) # sorts low to high
             if audio_quality == AudioQuality.HI:
                 bitrate = bitrates[-1]
             else:
                 bitrate = bitrates[audio_quality.value]
         
         # Set audio quality
-        index = self.list_bitrates().index(bitrate)
+        index = self._bitrate_to_idx[bitrate]
         self.audio_json = self.master_json['audio'][index]
         
         # Process video quality
         if video_quality == None:
             height = self._ask_video_quality()
         elif video_quality == VideoQuality.VMAX:
-            height = max(self.list_heights())
-        elif video_quality.value in self.list_heights():
+            height = max(self._heights)
+        elif video_quality.value in self._height_to_idx:
             height = video_quality.value
         else:
-            # fuzzy search within 5% pixel range
-            heights = self.list_heights()
-            position = None
-            for index, height in enumerate(heights):
-                if (height * 0.95) <= video_quality.value <= (height * 1.05):
-                    position = index
-                    break
-            if position != None:
-                height = heights[position]
+            # fuzzy search within 5% pixel range, nearest heights
+            # are on either side of the insertion point
+            heights = self._sorted_heights
+            insert = bisect.bisect_left(heights, video_quality.value)
+            nearby = heights[max(insert - 1, 0):insert + 1]
+            matches = [height for height in nearby
+                if (height * 0.95) <= video_quality.value <= (height * 1.05)]
+            if matches:
+                height = min(matches, key=lambda height: abs(height - video_quality.value))
             
             # fuzzy search failed, ask user if interactive mode
             else:
@@ -214,7 +342,7 @@ class VimeoDownload():
                     raise ValueError(f'Unable to find video quality matching {video_quality.value}p')
         
         # Set video quality
-        index = self.list_heights().index(height)
+        index = self._height_to_idx[height]
         self.video_json = self.master_json['video'][index]
 
         # configuration complete
@@ -233,58 +361,277 @@ class VimeoDownload():
         pathlib.Path(self.output_directory()).mkdir(parents=True, exist_ok=True)
         
         # download audio file
-        audio_base_url = self.base_url + self.audio_json['base_url']
         name = os.path.splitext(self.output_filename())[0]
         self.audio_file = f'{self.output_directory()}/{name}_audio_{self.audio_json['id']}.m4a'
-        audio_file = open(self.audio_file, 'wb')
-        init_segment = base64.b64decode(self.audio_json['init_segment'])
-        audio_file.write(init_segment)
-
-        for segment in tqdm(self.audio_json['segments']):
-            segment_url = audio_base_url + segment['url']
-            # segment_url = re.sub(r'/[a-zA-Z0-9_-]*/\.\./',r'/',segment_url.rstrip())
-            response = requests.get(segment_url, stream=True)
-            if response.status_code != 200:
-                print(f'ERROR: received http code [{response.status_code}] when downloading audio')
-                response.raise_for_status()
-            for chunk in response:
-                audio_file.write(chunk)
+        with open(self.audio_file, 'wb', buffering=WRITE_BUFFER) as audio_file:
+            self._download_stream(self.audio_json, audio_file, 'audio')
 
-        audio_file.flush()
-        audio_file.close()
-
-        # create video file
-        video_base_url = self.base_url + self.video_json['base_url']
+        # download video file
         self.video_file = f'{self.output_directory()}/{name}_video_{self.video_json['id']}.mp4'
-        video_file = open(self.video_file, 'wb')
-        init_segment = base64.b64decode(self.video_json['init_segment'])
-        video_file.write(init_segment)
+        with open(self.video_file, 'wb', buffering=WRITE_BUFFER) as video_file:
+            self._download_stream(self.video_json, video_file, 'video')
 
-        for segment in tqdm(self.video_json['segments']):
-            segment_url = video_base_url + segment['url']
-            response = requests.get(segment_url, stream=True)
-            if response.status_code != 200:
-                print(f'ERROR: received http code [{response.status_code}] when downloading video')
+    def stream_audio_video(self):
+        """
+        Downloads audio and video straight into ffmpeg through pipes, skipping
+        the intermediate stream files. Replaces download_audio_video() followed
+        by combine_audio_video(). Requires a posix os.
+        """
+        if self.audio_json == None or self.video_json == None:
+            raise ValueError('Error: must configure_quality() before calling stream_audio_video()')
+
+        print(f'\n======== {self.output_filename()} ========')
+        print(f'---- streaming audio and video ----')
+
+        # create output path if it doesn't exist
+        pathlib.Path(self.output_directory()).mkdir(parents=True, exist_ok=True)
+
+        # ffmpeg reads each stream from the read end of its own pipe,
+        # only its errors are shown so the progress bars stay readable
+        audio_read, audio_write = os.pipe()
+        video_read, video_write = os.pipe()
+        ffmpeg = subprocess.Popen([
+            'ffmpeg', '-v', 'error', '-nostats', '-y',
+            '-i', f'pipe:{audio_read}',
+            '-i', f'pipe:{video_read}',
+            '-c', 'copy',
+            self.output_file
+        ], pass_fds=(audio_read, video_read))
+        os.close(audio_read)
+        os.close(video_read)
+
+        def feed(stream_json, fd, stream_type, position):
+            # default buffering so ffmpeg receives data steadily
+            with open(fd, 'wb') as pipe:
+                self._download_stream(stream_json, pipe, stream_type, position)
+
+        # ffmpeg interleaves both inputs while muxing, so they're fed together
+        feed_error = None
+        ffmpeg_failed = False
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            feeds = [
+                executor.submit(feed, self.audio_json, audio_write, 'audio', 0),
+                executor.submit(feed, self.video_json, video_write, 'video', 1)
+            ]
+            try:
+                for stream in feeds:
+                    stream.result()
+            except BaseException as error:
+                feed_error = error
+                if isinstance(error, BrokenPipeError):
+                    # ffmpeg closed its input, give it time to exit by itself
+                    try:
+                        ffmpeg.wait(timeout=5)
+                    except subprocess.TimeoutExpired:
+                        pass
+                ffmpeg_failed = ffmpeg.poll() not in (None, 0)
+                # unblocks the other feed with a broken pipe
+                ffmpeg.kill()
+            finally:
+                ffmpeg.wait()
+
+        # a broken pipe only means ffmpeg stopped reading, report why it stopped
+        if feed_error != None:
+            if ffmpeg_failed:
+                raise subprocess.CalledProcessError(ffmpeg.returncode, ffmpeg.args) from feed_error
+            raise feed_error
+        if ffmpeg.returncode != 0:
+            raise subprocess.CalledProcessError(ffmpeg.returncode, ffmpeg.args)
+
+    def _download_stream(self, stream_json, out_file, stream_type: str, position: int = 0):
+        """
+        Downloads the segments of an audio or video stream concurrently and
+        writes them to out_file in order. position sets the progress bar line
+        when several streams download at once.
+        """
+        # base_url is shared by every segment of the stream, normalize it once
+        base_url = _normalize_url(self.base_url + stream_json['base_url'])
+        init_segment = b64decode(stream_json['init_segment'])
+        segments = stream_json['segments']
+        preallocated = False
+        if all('size' in segment for segment in segments):
+            total_size = len(init_segment) + sum(segment['size'] for segment in segments)
+            preallocated = self._preallocate(out_file, total_size)
+        out_file.write(init_segment)
+
+        # set once the cdn rejects a merged range, the rest of the stream
+        # is then requested segment by segment
+        unmerged = threading.Event()
+
+        def fetch(request):
+            url, segment_urls, size = request
+            if len(segment_urls) > 1 and not unmerged.is_set():
+                try:
+                    return self._fetch_with_retry(url, stream_type, size)
+                except _RangeError:
+                    unmerged.set()
+            return b''.join(self._fetch_with_retry(segment_url, stream_type)
+                for segment_url in segment_urls)
+
+        urls = [base_url + segment['url'] for segment in segments]
+        plan = self._coalesce_segments(urls)
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, tqdm(total=len(segments), position=position) as progress:
+                # downloads overlap within a sliding window, written in order
+                # as its head completes so read ahead stays bounded
+                window = deque()
+
+                def write_next():
+                    request, future = window.popleft()
+                    out_file.write(future.result())
+                    progress.update(len(request[1]))
+
+                for request in plan:
+                    if len(window) >= 2 * MAX_WORKERS:
+                        write_next()
+                    window.append((request, executor.submit(fetch, request)))
+                while window:
+                    write_next()
+        finally:
+            # drop any preallocated space that wasn't written, a failed
+            # download is left short instead of padded with zeros
+            if preallocated:
+                out_file.truncate()
+
+    def _preallocate(self, out_file, size: int) -> bool:
+        """
+        Reserves disk space for the whole stream up front to avoid fragmenting
+        the file across many small writes. Only supported where the os
+        provides posix_fallocate.
+
+        Returns: True if space was reserved
+        """
+        if not hasattr(os, 'posix_fallocate'):
+            return False
+        try:
+            os.posix_fallocate(out_file.fileno(), 0, size)
+        except OSError:
+            return False
+        return True
+
+    def _coalesce_segments(self, urls: list) -> list:
+        """
+        Returns: list of (url, segment urls, size) requests
+
+        With query string ranges, segments are consecutive byte ranges of the
+        same file. Those are merged into a single request covering up to
+        COALESCE_BYTES, size is the expected length of the merged response.
+        Any other segment is requested on its own with a size of None.
+        """
+        plan = []
+        group = None # [url head, url tail, start, end, segment urls]
+        for segment_url in urls:
+            match = _RANGE_RE.search(segment_url)
+            if match == None:
+                plan.append((segment_url, [segment_url], None))
+                group = None
+                continue
+
+            head = segment_url[:match.start(1)]
+            tail = segment_url[match.end(2):]
+            start, end = int(match.group(1)), int(match.group(2))
+            if (group != None and group[0] == head and group[1] == tail
+                    and start == group[3] + 1 and end - group[2] < COALESCE_BYTES):
+                group[3] = end
+                group[4].append(segment_url)
+                plan[-1] = (f'{head}{group[2]}-{end}{tail}', group[4], end - group[2] + 1)
+            else:
+                group = [head, tail, start, end, [segment_url]]
+                plan.append((segment_url, group[4], end - start + 1))
+        return plan
+
+    def _fetch_with_retry(self, url: str, stream_type: str, size: int = None) -> bytes:
+        """
+        Returns: segment content
+
+        Retries with exponential backoff when the cdn responds with http 429,
+        throttling that outlasts the retries is raised as an http error.
+        When size is given the url is a merged byte range, any other status
+        than 200 or a different length raises _RangeError instead. The length
+        is checked against Content-Length before the body is read, so a cdn
+        ignoring the range doesn't send the whole file.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            response = self._get_segment(url)
+            if response.status_code != 429 or attempt == MAX_RETRIES:
+                break
+            response.close()
+            retry_after = response.headers.get('Retry-After', '')
+            delay = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+            time.sleep(delay)
+
+        try:
+            if response.status_code == 429 or (size == None and response.status_code != 200):
+                print(f'ERROR: received http code [{response.status_code}] when downloading {stream_type}')
                 response.raise_for_status()
-            for chunk in response:
-                video_file.write(chunk)
+            if size != None:
+                if response.status_code != 200:
+                    raise _RangeError(f'received http code [{response.status_code}]')
+                content_length = response.headers.get('Content-Length')
+                if content_length != None and int(content_length) != size:
+                    raise _RangeError(f'expected {size} bytes, cdn is sending {content_length}')
+            # copy raw media bytes in 1 MiB blocks, no content decoding
+            content = io.BytesIO()
+            if httpx != None:
+                for chunk in response.iter_raw(1 << 20):
+                    content.write(chunk)
+            else:
+                response.raw.decode_content = False
+                shutil.copyfileobj(response.raw, content, length=1 << 20)
+            if size != None and content.tell() != size:
+                raise _RangeError(f'expected {size} bytes, received {content.tell()}')
+            return content.getvalue()
+        finally:
+            response.close()
 
-        # video cleanup
-        video_file.flush()
-        video_file.close()
-    
-    def combine_audio_video(self):
+    def _get_segment(self, url: str):
+        """
+        Returns: streamed response, body not yet read
+        """
+        if httpx != None:
+            with self._http2_lock:
+                if VimeoDownload.http2_client == None:
+                    # no timeouts like the requests session, and enough
+                    # connections for audio and video downloading together
+                    VimeoDownload.http2_client = httpx.Client(
+                        http2=True,
+                        follow_redirects=True,
+                        timeout=httpx.Timeout(None),
+                        limits=httpx.Limits(max_connections=2 * MAX_WORKERS)
+                    )
+                client = VimeoDownload.http2_client
+            request = client.build_request('GET', url, headers=_SEGMENT_HEADERS)
+            return client.send(request, stream=True)
+        return self.session.get(url, headers=_SEGMENT_HEADERS, stream=True)
+
+    def combine_audio_video(self, background: bool = False):
+        """
+        Combines the downloaded audio and video into the output file.
+
+        Parameters:
+        background (bool): combine while other downloads show progress,
+            prints nothing but ffmpeg errors to keep progress bars readable
+        """
         if self.audio_file == None or self.video_file == None:
             raise ValueError('Error: must download_audio_video() before calling combine_audio_video()')
         if not os.path.exists(self.audio_file) or not os.path.exists(self.video_file):
             raise ValueError('Error: unable to find specified audio and video files to be combined.')
         
-        print(f'\n======== {self.output_filename()} ========')
-        print(f'---- combining audio and video ----')
+        if background:
+            verbosity = ['-v', 'error', '-nostats']
+        else:
+            verbosity = ['-v', 'quiet', '-stats']
+            print(f'\n======== {self.output_filename()} ========')
+            print(f'---- combining audio and video ----')
 
-        # combine using ffmpeg
-        command = f'ffmpeg -v quiet -stats -y -i "{self.audio_file}" -i "{self.video_file}" "{self.output_file}"'
-        subprocess.call(command, shell=True)
+        # combine using ffmpeg, streams are copied as is without re-encoding
+        subprocess.run([
+            'ffmpeg', *verbosity, '-y',
+            '-i', self.audio_file,
+            '-i', self.video_file,
+            '-c', 'copy',
+            self.output_file
+        ], check=True)
 
         # delete stream files
         os.remove(self.audio_file)
@@ -301,22 +648,55 @@ if __name__ == "__main__":
         type=argparse.FileType('r', encoding='UTF-8'),
         help='tab-separated values file containing vimeo download requests')
     
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='pipe downloads straight into ffmpeg without intermediate files')
+    
     # parse tsv file
     args = parser.parse_args()
-    tsv_file = csv.reader(args.tsv_file, delimiter="\t")
-    request_list = []
-    for video, audio, output, url in tsv_file:
-        download = VimeoDownload(output, url)
-        video_quality = VideoQuality[video] if video else None
-        audio_quality = AudioQuality[audio] if audio else None
-        download.configure_quality(True, audio_quality, video_quality)
-        request_list.append(download)
+    rows = list(csv.reader(args.tsv_file, delimiter="\t"))
     args.tsv_file.close()
 
-    # prioritize downloading audio video in case endpoints expire
-    for download in request_list:
-        download.download_audio_video()
-    
-    # combine audio video
-    for download in request_list:
-        download.combine_audio_video()
\ No newline at end of file
+    try:
+        # fetch every master.json at once instead of one per row
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            master_jsons = list(executor.map(VimeoDownload.fetch_master_json, [row[3] for row in rows]))
+
+        request_list = []
+        for (video, audio, output, url), master_json in zip(rows, master_jsons):
+            download = VimeoDownload.from_master_json(output, url, master_json)
+            video_quality = VideoQuality[video] if video else None
+            audio_quality = AudioQuality[audio] if audio else None
+            download.configure_quality(True, audio_quality, video_quality)
+            request_list.append(download)
+
+        if args.stream:
+            # download and combine in one pass
+            for download in request_list:
+                download.stream_audio_video()
+        else:
+            # prioritize downloading audio video in case endpoints expire,
+            # combine finished downloads in the background while the next one downloads
+            combine_errors = []
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                combines = []
+                try:
+                    for download in request_list:
+                        download.download_audio_video()
+                        combines.append((download, executor.submit(download.combine_audio_video, True)))
+                finally:
+                    # report every started combine, even when a later download failed
+                    for download, combine in combines:
+                        print(f'\n======== {download.output_filename()} ========')
+                        try:
+                            combine.result()
+                        except Exception as error:
+                            print(f'ERROR: unable to combine audio and video: {error}')
+                            combine_errors.append(error)
+                        else:
+                            print(f'---- combined audio and video ----')
+            if combine_errors:
+                raise combine_errors[0]
+    finally:
+        VimeoDownload.close()